@@ -1,9 +1,9 @@
 """
 agent.py
-LangChain + LangGraph agent that connects to the SJ Piano MCP server and
-reasons through the full payment-tracking workflow.
-
-Compatible with Python 3.14+ and langchain-mcp-adapters 0.1.0+
+LangChain + LangGraph agent that reasons through the full payment-tracking
+workflow. The tools defined in mcp_server.py are loaded in-process, so no
+MCP subprocess is spawned; mcp_server.py can still be run on its own as a
+stdio server for external MCP clients.
 
 Run with:
     python agent.py
@@ -11,14 +11,21 @@ Run with:
 
 import asyncio
 import os
+import sys
 from dotenv import load_dotenv
 
 load_dotenv(override=False)  # env vars from GitHub Actions take priority
 
 from langchain_anthropic import ChatAnthropic
-from langchain_mcp_adapters.client import MultiServerMCPClient
 from langgraph.prebuilt import create_react_agent
 from langchain_core.messages import HumanMessage
+from langchain_core.tools import tool
+
+from mcp_server import (
+    close_mongo,
+    ensure_indexes,
+    process_all_payments,
+)
 
 
 # ════════════════════════════════════════════════════════════════════════════
@@ -31,81 +38,107 @@ Your job is to process Interac e-Transfer payment emails and ensure each payment
 is properly recorded and acknowledged. Follow these steps EXACTLY and IN ORDER:
 
 ---
-STEP 1 — Search Gmail
-Call `search_interac_emails` to get all Interac e-Transfer emails from the
-start of the current month up to now.
-
-If no emails are found, report "No Interac e-Transfer emails found this month."
-and stop.
+STEP 1 — Process all payments
+Call `process_all_payments` exactly once. It searches Gmail for this month's
+Interac e-Transfer emails and, for each one, validates the student (parent name,
+reply-to email AND amount must all match), creates the invoice unless one already
+exists for that month, and emails the PDF receipt to the student's address from
+MongoDB.
 
----
-STEP 2 — For each email found, do the following sub-steps:
-
-  2a. VALIDATE STUDENT
-      Call `find_student_by_parent` with:
-        - parent_name:    extracted from the email subject
-        - reply_to_email: the reply-to address from the email
-        - amount:         the dollar amount from the email subject
-
-      If no matching student is found, log a warning for this email and
-      move on to the next one. Do NOT proceed with this email.
-
-  2b. CHECK FOR EXISTING INVOICE
-      Call `check_invoice_exists` with the student's email from MongoDB.
-
-      If an invoice already exists for this month:
-        - Log: "Invoice already exists for <student_name> (<email>) — skipping."
-        - Move on to the next email. Do NOT create a duplicate.
-
-  2c. CREATE INVOICE
-      Call `create_invoice` with:
-        - student_name:      from the MongoDB student record
-        - student_email:     from the MongoDB student record
-        - amount:            from the email
-        - fee_paid_date_iso: the date the email was received (ISO 8601 UTC)
-
-  2d. SEND THANK-YOU EMAIL
-      Call `send_thank_you_email` with:
-        - student_name:      from MongoDB
-        - student_email:     from MongoDB
-        - amount:            from the email
-        - invoice_number:    from the newly created invoice (step 2c)
-        - fee_paid_date_iso: the date the email was received
+If it returns status "no_emails", report "No Interac e-Transfer emails found this
+month." and stop. If it returns status "error", report the error message and stop.
 
 ---
-STEP 3 — Final Report
-After processing all emails, produce a clear summary:
+STEP 2 — Final Report
+From the `results` list, produce a clear summary:
   - How many emails were found
-  - For each: student name, amount, action taken (processed / skipped / error)
+  - For each: student name (or parent name if no student matched), amount,
+    action taken (processed / skipped / error) and the message, if any
 
 ---
 IMPORTANT RULES:
-- Never create a duplicate invoice for the same student in the same month.
-- Only proceed if parent name, email, AND amount ALL match a student record.
-- Always use the student's email from MongoDB (not the reply-to) for sending.
-- Be methodical. Process one email at a time, completing all sub-steps before moving on.
+- Do not call `process_all_payments` more than once per run.
+- Report only what the tool returned; do not guess at missing fields.
 """
 
 
+# ════════════════════════════════════════════════════════════════════════════
+# Stream event handlers
+# ════════════════════════════════════════════════════════════════════════════
+
+class _StreamBuffer:
+    """
+    Collects one run's streamed model text and writes it in batches instead
+    of one flushed write per token.
+    """
+
+    def __init__(self, max_chunks: int = 64):
+        self._parts: list[str] = []
+        self._max_chunks = max_chunks
+
+    def write(self, text: str):
+        self._parts.append(text)
+        if "\n" in text or len(self._parts) > self._max_chunks:
+            self.flush()
+
+    def flush(self):
+        if self._parts:
+            sys.stdout.write("".join(self._parts))
+            self._parts.clear()
+            sys.stdout.flush()
+
+
+def _on_tool_start(event, out: _StreamBuffer):
+    out.flush()
+    print(f"\n[TOOL CALL] {event.get('name', 'unknown_tool')}")
+    inp = event["data"].get("input")
+    if inp:
+        for k, v in inp.items():
+            print(f"  {k}: {v}")
+
+
+def _on_tool_end(event, out: _StreamBuffer):
+    out.flush()
+    output = event["data"].get("output", "")
+    print(f"[TOOL RESULT] {event.get('name', 'unknown_tool')}: {str(output)[:300]}")
+
+
+def _on_chunk(event, out: _StreamBuffer):
+    chunk = event["data"].get("chunk")
+    if chunk and hasattr(chunk, "content"):
+        content = chunk.content
+        if isinstance(content, str) and content:
+            out.write(content)
+        elif isinstance(content, list):
+            for block in content:
+                if isinstance(block, dict) and block.get("type") == "text":
+                    out.write(block.get("text", ""))
+
+
+def _ignore(event, out: _StreamBuffer):
+    return None
+
+
+HANDLERS = {
+    "on_tool_start": _on_tool_start,
+    "on_tool_end": _on_tool_end,
+    "on_chat_model_stream": _on_chunk,
+}
+
+
 # ════════════════════════════════════════════════════════════════════════════
 # Agent
 # ════════════════════════════════════════════════════════════════════════════
 
 async def run_agent():
-    # ── Connect to MCP server (no context manager in 0.1.0+) ──────────────
-    mcp_client = MultiServerMCPClient(
-        {
-            "sjpiano": {
-                "command": "python",
-                "args": ["mcp_server.py"],
-                "transport": "stdio",
-                "env": dict(os.environ),  # explicitly pass all env vars to subprocess
-            }
-        }
-    )
+    # One-time startup work the standalone MCP server also does
+    await asyncio.to_thread(ensure_indexes)
 
-    # Direct call — no "async with" needed in langchain-mcp-adapters 0.1.0+
-    tools = await mcp_client.get_tools()
+    # ── Only the tool the prompt uses, called directly ────────────────────
+    # process_all_payments runs the whole per-email workflow in Python, so
+    # the model needs one round trip instead of one per step. The per-step
+    # tools stay on the MCP server for external clients.
+    tools = [tool(process_all_payments)]
 
     llm = ChatAnthropic(
         model="claude-opus-4-6",
@@ -123,44 +156,26 @@ async def run_agent():
     print("  SJ Piano Academy - Payment Tracker Agent")
     print("=" * 60 + "\n")
 
-    async for event in agent.astream_events(
-        {
-            "messages": [
-                HumanMessage(
-                    content=(
-                        "Please process all Interac e-Transfer payment emails "
-                        "for this month. Follow your instructions step by step."
+    out = _StreamBuffer()
+    try:
+        async for event in agent.astream_events(
+            {
+                "messages": [
+                    HumanMessage(
+                        content=(
+                            "Please process all Interac e-Transfer payment emails "
+                            "for this month. Follow your instructions step by step."
+                        )
                     )
-                )
-            ]
-        },
-        version="v2",
-    ):
-        kind = event.get("event")
-
-        if kind == "on_tool_start":
-            tool_name = event.get("name", "unknown_tool")
-            print(f"\n[TOOL CALL] {tool_name}")
-            inp = event.get("data", {}).get("input", {})
-            if inp:
-                for k, v in inp.items():
-                    print(f"  {k}: {v}")
-
-        elif kind == "on_tool_end":
-            tool_name = event.get("name", "unknown_tool")
-            output = event.get("data", {}).get("output", "")
-            print(f"[TOOL RESULT] {tool_name}: {str(output)[:300]}")
-
-        elif kind == "on_chat_model_stream":
-            chunk = event.get("data", {}).get("chunk")
-            if chunk and hasattr(chunk, "content"):
-                content = chunk.content
-                if isinstance(content, str) and content:
-                    print(content, end="", flush=True)
-                elif isinstance(content, list):
-                    for block in content:
-                        if isinstance(block, dict) and block.get("type") == "text":
-                            print(block.get("text", ""), end="", flush=True)
+                ]
+            },
+            version="v2",
+        ):
+            HANDLERS.get(event["event"], _ignore)(event, out)
+    finally:
+        # Also on error, so buffered text isn't lost before the traceback
+        out.flush()
+        await close_mongo()
 
     print("\n\n" + "=" * 60)
     print("Agent finished.")
@@ -7,25 +7,32 @@ payment-tracking workflow:
   2. find_student_by_parent  – look up student in pianostudents collection
   3. check_invoice_exists    – check if invoice already exists for this month
   4. create_invoice          – insert a new invoice into the invoices collection
-  5. send_thank_you_email    – email a PDF receipt to the student
+  5. create_invoice_if_absent – check + insert this month's invoice in one upsert
+  6. send_thank_you_email    – email a PDF receipt to the student
+  7. process_all_payments    – run the whole workflow for every email concurrently
 
 Run with:
     python mcp_server.py
 """
 
 import os
-import json
+import asyncio
+import atexit
+import logging
+import threading
 import base64
 import smtplib
 import time
 import re
+import functools
 import email as email_lib
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.application import MIMEApplication
+from email.message import EmailMessage
+from email.utils import getaddresses, parsedate_to_datetime
 from typing import Optional
 
+import orjson
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -36,7 +43,9 @@ from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
 
 # ── MongoDB ─────────────────────────────────────────────────────────────────
-from pymongo import MongoClient
+from pymongo import ASCENDING, AsyncMongoClient, MongoClient
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from pymongo.collation import Collation
 
 # ── MCP ─────────────────────────────────────────────────────────────────────
 from mcp.server.fastmcp import FastMCP
@@ -48,12 +57,18 @@ from receipt_generator import generate_receipt
 # Configuration
 # ════════════════════════════════════════════════════════════════════════════
 
+logger = logging.getLogger(__name__)
+
 GMAIL_SCOPES = [
     "https://www.googleapis.com/auth/gmail.readonly",
     "https://www.googleapis.com/auth/gmail.send",
 ]
 CREDENTIALS_FILE = os.getenv("GMAIL_CREDENTIALS_FILE", "credentials.json")
 TOKEN_FILE = os.getenv("GMAIL_TOKEN_FILE", "token.json")
+# Gmail list page size, also used as the batch size for metadata fetches
+GMAIL_PAGE_SIZE = 50
+# Backoff retries for metadata fetches that failed inside a batch
+GMAIL_RETRIES = 5
 
 MONGO_URI = os.getenv("MONGO_URI", "")
 MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "")
@@ -62,12 +77,44 @@ SMTP_USER = os.getenv("GMAIL_SMTP_USER", "")
 SMTP_APP_PASSWORD = os.getenv("GMAIL_SMTP_APP_PASSWORD", "")
 BCC_EMAIL = os.getenv("BCC_EMAIL", "")
 
+# Case-insensitive equality (strength 2 ignores case, not diacritics).
+# Queries must use the same collation as the indexes below to hit them.
+CASE_INSENSITIVE = Collation("en", strength=2)
+
+# Only the fields the agent needs for create_invoice / send_thank_you_email
+STUDENT_PROJECTION = {
+    "_id": 1,
+    "name": 1,
+    "StudentName": 1,
+    "email": 1,
+    "ParentName": 1,
+    "amount": 1,
+}
+INVOICE_PROJECTION = {
+    "_id": 1,
+    "invoicenumber": 1,
+    "feepaiddate": 1,
+    "students.email": 1,
+}
+
+# Precompiled subject pattern: "received $X.XX from <Name> and it has been"
+_RE_SUBJECT = re.compile(
+    r"received \$(?P<amount>\d+(?:\.\d+)?)\s+from\s+(?P<parent>.+?)\s+and\s+it\s+has\s+been",
+    re.IGNORECASE,
+)
+
 # ════════════════════════════════════════════════════════════════════════════
 # Helpers
 # ════════════════════════════════════════════════════════════════════════════
 
+def _dumps(obj) -> str:
+    """Serialize a tool result to JSON; datetimes become ISO 8601 (naive = UTC)."""
+    return orjson.dumps(obj, option=orjson.OPT_NAIVE_UTC).decode()
+
+
+@functools.lru_cache(maxsize=1)
 def _get_gmail_service():
-    """Authenticate and return a Gmail API service object."""
+    """Authenticate and return a Gmail API service object (cached per process)."""
     creds = None
     if os.path.exists(TOKEN_FILE):
         creds = Credentials.from_authorized_user_file(TOKEN_FILE, GMAIL_SCOPES)
@@ -82,55 +129,279 @@ def _get_gmail_service():
     return build("gmail", "v1", credentials=creds)
 
 
+@functools.lru_cache(maxsize=1)
+def _get_mongo_client() -> AsyncMongoClient:
+    """Return the async MongoDB client (client and pool reused per process)."""
+    return AsyncMongoClient(MONGO_URI, maxPoolSize=10, serverSelectionTimeoutMS=3000)
+
+
 def _get_mongo_db():
     """Return the MongoDB database object."""
-    client = MongoClient(MONGO_URI)
-    return client[MONGO_DB_NAME]
+    return _get_mongo_client()[MONGO_DB_NAME]
+
+
+# Explicit names, so an equivalent index created by hand is recognised
+# and a conflicting one is reported rather than silently duplicated.
+_INDEXES = [
+    ("pianostudents", "parent_email_amount_ci",
+     [("ParentName", ASCENDING), ("email", ASCENDING), ("amount", ASCENDING)], {}),
+    ("invoices", "student_email_feepaiddate_ci",
+     [("students.email", ASCENDING), ("feepaiddate", ASCENDING)], {}),
+    # One invoice per student per month. Partial, so invoices created before
+    # invoicemonth existed don't collide on a missing (null) value.
+    ("invoices", "student_email_invoicemonth_unique",
+     [("students.email", ASCENDING), ("invoicemonth", ASCENDING)],
+     {"unique": True, "partialFilterExpression": {"invoicemonth": {"$exists": True}}}),
+]
+
+
+def ensure_indexes():
+    """
+    Create the indexes backing the student and invoice lookups. Call once at
+    startup. A failure is logged and the server carries on: lookups still
+    work, but without the unique index create_invoice_if_absent is no
+    longer safe against concurrent duplicate inserts.
+    """
+    try:
+        with MongoClient(MONGO_URI, serverSelectionTimeoutMS=3000) as client:
+            db = client[MONGO_DB_NAME]
+            for collection, name, keys, options in _INDEXES:
+                try:
+                    db[collection].create_index(
+                        keys, name=name, collation=CASE_INSENSITIVE, **options,
+                    )
+                except PyMongoError as e:
+                    logger.warning("Could not create index %s on %s: %s", name, collection, e)
+    except PyMongoError as e:
+        logger.warning("Could not connect to MongoDB to create indexes: %s", e)
+
+
+async def close_mongo():
+    """Close the cached Mongo client, if one was created.
+
+    The async client is bound to the running event loop, so this is awaited
+    on shutdown (server lifespan / end of run_agent) rather than via atexit.
+    """
+    if _get_mongo_client.cache_info().currsize:
+        await _get_mongo_client().close()
+    _get_mongo_client.cache_clear()
+
+
+_invoice_number_lock = threading.Lock()
+_last_invoice_number = 0
+
+
+def _next_invoice_number() -> str:
+    """Return a millisecond-timestamp invoice number, unique within this process."""
+    global _last_invoice_number
+    with _invoice_number_lock:
+        _last_invoice_number = max(int(time.time() * 1000), _last_invoice_number + 1)
+        return str(_last_invoice_number)
+
+
+class _TrackingSMTP(smtplib.SMTP_SSL):
+    """SMTP_SSL that records whether DATA was issued for the current message."""
+
+    data_sent = False
+
+    def data(self, msg):
+        self.data_sent = True
+        return super().data(msg)
+
+
+_smtp_conn: Optional[_TrackingSMTP] = None
+_smtp_lock = threading.Lock()
+
+
+def _get_smtp() -> _TrackingSMTP:
+    """Return a logged-in Gmail SMTP connection, reconnecting if it went stale.
+
+    Caller must hold ``_smtp_lock``.
+    """
+    global _smtp_conn
+    if _smtp_conn is not None:
+        try:
+            _smtp_conn.noop()
+            return _smtp_conn
+        except (smtplib.SMTPException, OSError):
+            _close_smtp_conn()
+    smtp = _TrackingSMTP("smtp.gmail.com", 465)
+    try:
+        smtp.login(SMTP_USER, SMTP_APP_PASSWORD)
+    except BaseException:
+        smtp.close()
+        raise
+    _smtp_conn = smtp
+    return smtp
+
 
+def _close_smtp_conn():
+    """Drop the cached SMTP connection. Caller must hold ``_smtp_lock``."""
+    global _smtp_conn
+    if _smtp_conn is not None:
+        try:
+            _smtp_conn.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        _smtp_conn = None
 
-def _extract_reply_to(msg_payload: dict) -> Optional[str]:
-    """Extract Reply-To header from a Gmail message payload."""
-    headers = msg_payload.get("headers", [])
-    for h in headers:
-        if h["name"].lower() == "reply-to":
-            # May look like "Name <email@example.com>" or just "email@example.com"
-            val = h["value"]
-            match = re.search(r"[\w.\-+]+@[\w.\-]+", val)
-            return match.group(0) if match else val
-    return None
 
+def _close_smtp():
+    with _smtp_lock:
+        _close_smtp_conn()
 
-def _extract_date_received(msg_payload: dict) -> Optional[datetime]:
-    """Extract the Date header and return as UTC datetime."""
-    headers = msg_payload.get("headers", [])
-    for h in headers:
-        if h["name"].lower() == "date":
-            from email.utils import parsedate_to_datetime
-            try:
-                return parsedate_to_datetime(h["value"]).astimezone(timezone.utc)
-            except Exception:
-                pass
-    return None
 
+atexit.register(_close_smtp)
 
-def _parse_amount(subject: str) -> Optional[float]:
-    """Extract dollar amount from subject like 'received $200.00 from'."""
-    match = re.search(r"\$(\d+(?:\.\d+)?)", subject)
-    return float(match.group(1)) if match else None
 
+def _smtp_send_message(msg: EmailMessage):
+    """
+    Send on the shared SMTP connection. If the link drops before DATA is
+    sent, reconnect and retry once; after DATA the server may already have
+    accepted the mail, so the error is raised rather than risk a duplicate.
+    """
+    with _smtp_lock:
+        smtp = _get_smtp()
+        smtp.data_sent = False
+        try:
+            smtp.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            _close_smtp_conn()
+            if smtp.data_sent:
+                raise
+            _get_smtp().send_message(msg)
+
+
+@functools.lru_cache(maxsize=4)
+def _month_window(year: int, month: int) -> tuple[datetime, datetime, int]:
+    """Return (start_of_month, start_of_next_month, start_epoch) in UTC."""
+    start = datetime(year, month, 1, tzinfo=timezone.utc)
+    if month == 12:
+        end = datetime(year + 1, 1, 1, tzinfo=timezone.utc)
+    else:
+        end = datetime(year, month + 1, 1, tzinfo=timezone.utc)
+    return start, end, int(start.timestamp())
+
+
+def _current_month_window() -> tuple[datetime, datetime, int]:
+    """Return the month window for the current UTC month."""
+    now = datetime.now(timezone.utc)
+    return _month_window(now.year, now.month)
+
+
+def _invoice_month(fee_paid_date: datetime) -> str:
+    """Return the "YYYY-MM" key an invoice is unique on for its student."""
+    return f"{fee_paid_date.year:04d}-{fee_paid_date.month:02d}"
+
+
+def _build_invoice_doc(
+    invoice_number: str,
+    student_name: str,
+    student_email: str,
+    amount: float,
+    fee_paid_date: datetime,
+) -> dict:
+    """Return a new invoice document in the shape the invoices collection uses."""
+    return {
+        "invoicenumber": invoice_number,
+        "students": {
+            "name": student_name,
+            "address": "",
+            "email": student_email,
+            "phone": "",
+        },
+        "totalamount": float(amount),
+        "tax": 0,
+        "feepaiddate": fee_paid_date,
+        "invoicemonth": _invoice_month(fee_paid_date),
+        "paymentstatus": "Paid",
+        "items": [],
+        "dateissued": int(time.time() * 1000),
+        "__v": 0,
+    }
+
+
+def _extract_reply_to(headers: dict) -> Optional[str]:
+    """Extract the Reply-To address from a lower-cased Gmail headers dict."""
+    val = headers.get("reply-to")
+    if val is None:
+        return None
+    # May look like "Name <email@example.com>" or just "email@example.com"
+    addrs = getaddresses([val])
+    return addrs[0][1] if addrs and addrs[0][1] else val
+
+
+def _extract_date_received(headers: dict) -> Optional[datetime]:
+    """Extract the Date header from a lower-cased headers dict as UTC datetime."""
+    val = headers.get("date")
+    if val is None:
+        return None
+    try:
+        return parsedate_to_datetime(val).astimezone(timezone.utc)
+    except Exception:
+        return None
 
-def _parse_parent_name(subject: str) -> Optional[str]:
-    """Extract parent name from Interac subject line."""
-    # Pattern: "received $X.XX from <Name> and it has been"
-    match = re.search(r"received \$[\d.]+\s+from\s+(.+?)\s+and\s+it\s+has\s+been", subject, re.IGNORECASE)
-    return match.group(1).strip() if match else None
+
+def _parse_subject(subject: str) -> tuple[Optional[float], Optional[str]]:
+    """Extract (amount, parent_name) from an Interac subject in one pass."""
+    match = _RE_SUBJECT.search(subject)
+    if not match:
+        return None, None
+    return float(match.group("amount")), match.group("parent").strip()
+
+
+def _metadata_request(service, msg_id: str):
+    return service.users().messages().get(
+        userId="me",
+        id=msg_id,
+        format="metadata",
+        metadataHeaders=["Subject", "Reply-To", "Date"],
+    )
+
+
+def _fetch_message_metadata(service, msg_ids: list) -> dict:
+    """Fetch metadata for msg_ids in batched HTTP requests, keyed by message id.
+
+    Entries that fail inside a batch (Gmail often answers some of them with
+    429) are retried one by one with exponential backoff; only a failure
+    that survives the retries is raised.
+    """
+    fetched = {}
+    failed = []
+
+    def _on_msg(request_id, response, exception):
+        if exception is not None:
+            failed.append(request_id)
+        else:
+            fetched[request_id] = response
+
+    # One batch per page
+    for i in range(0, len(msg_ids), GMAIL_PAGE_SIZE):
+        batch = service.new_batch_http_request(callback=_on_msg)
+        for msg_id in msg_ids[i:i + GMAIL_PAGE_SIZE]:
+            batch.add(_metadata_request(service, msg_id), request_id=msg_id)
+        batch.execute()
+
+    for msg_id in failed:
+        fetched[msg_id] = _metadata_request(service, msg_id).execute(
+            num_retries=GMAIL_RETRIES,
+        )
+    return fetched
 
 
 # ════════════════════════════════════════════════════════════════════════════
 # MCP Server
 # ════════════════════════════════════════════════════════════════════════════
 
-mcp = FastMCP("SJPiano Payment Tracker")
+@asynccontextmanager
+async def _lifespan(server):
+    try:
+        yield
+    finally:
+        await close_mongo()
+
+
+mcp = FastMCP("SJPiano Payment Tracker", lifespan=_lifespan)
 
 
 @mcp.tool()
@@ -151,66 +422,72 @@ def search_interac_emails() -> str:
         service = _get_gmail_service()
 
         # Build date range: 1st of current month 00:00 UTC → now
-        now = datetime.now(timezone.utc)
-        start_of_month = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
         # Gmail query uses epoch seconds for after:/before:
-        after_epoch = int(start_of_month.timestamp())
+        _, _, after_epoch = _current_month_window()
 
+        # Gmail does all the filtering; no Python-side subject check needed
         query = (
             f'subject:"Interac e-Transfer" '
             f'subject:"automatically deposited" '
-            f'after:{after_epoch}'
+            f'after:{after_epoch} '
+            f'-in:spam -category:promotions'
         )
 
         result = service.users().messages().list(
             userId="me",
             q=query,
-            maxResults=50,
+            maxResults=GMAIL_PAGE_SIZE,
+            includeSpamTrash=False,
         ).execute()
-
         messages = result.get("messages", [])
+
+        # Only page further on a full page, so busy months aren't truncated
+        while result.get("nextPageToken") and len(result.get("messages", [])) == GMAIL_PAGE_SIZE:
+            result = service.users().messages().list(
+                userId="me",
+                q=query,
+                maxResults=GMAIL_PAGE_SIZE,
+                includeSpamTrash=False,
+                pageToken=result["nextPageToken"],
+            ).execute()
+            messages.extend(result.get("messages", []))
+
         if not messages:
-            return json.dumps({"status": "no_emails", "emails": []})
+            return _dumps({"status": "no_emails", "emails": []})
+
+        fetched = _fetch_message_metadata(service, [m["id"] for m in messages])
 
         matched = []
         for msg_ref in messages:
-            msg = service.users().messages().get(
-                userId="me",
-                id=msg_ref["id"],
-                format="metadata",
-                metadataHeaders=["Subject", "Reply-To", "Date"],
-            ).execute()
+            msg = fetched.get(msg_ref["id"])
+            if msg is None:
+                continue
 
             payload = msg.get("payload", {})
             headers = {h["name"].lower(): h["value"] for h in payload.get("headers", [])}
             subject = headers.get("subject", "")
 
-            # Must contain "automatically deposited"
-            if "automatically deposited" not in subject.lower():
-                continue
-
-            reply_to = _extract_reply_to(payload) or headers.get("reply-to", "")
-            date_received = _extract_date_received(payload)
-            parent_name = _parse_parent_name(subject)
-            amount = _parse_amount(subject)
+            reply_to = _extract_reply_to(headers) or ""
+            date_received = _extract_date_received(headers)
+            amount, parent_name = _parse_subject(subject)
 
             matched.append({
                 "message_id": msg_ref["id"],
                 "subject": subject,
                 "reply_to": reply_to,
-                "date_received": date_received.isoformat() if date_received else None,
+                "date_received": date_received,
                 "parent_name": parent_name,
                 "amount": amount,
             })
 
-        return json.dumps({"status": "ok", "emails": matched})
+        return _dumps({"status": "ok", "emails": matched})
 
     except Exception as e:
-        return json.dumps({"status": "error", "message": str(e)})
+        return _dumps({"status": "error", "message": str(e)})
 
 
 @mcp.tool()
-def find_student_by_parent(parent_name: str, reply_to_email: str, amount: float) -> str:
+async def find_student_by_parent(parent_name: str, reply_to_email: str, amount: float) -> str:
     """
     Look up a student in the pianostudents collection by matching:
       - ParentName  == parent_name  (case-insensitive)
@@ -224,14 +501,18 @@ def find_student_by_parent(parent_name: str, reply_to_email: str, amount: float)
         # Amount stored as string like "200"
         amount_str = str(int(amount))
 
-        student = db.pianostudents.find_one({
-            "ParentName": {"$regex": f"^{re.escape(parent_name)}$", "$options": "i"},
-            "email": {"$regex": f"^{re.escape(reply_to_email)}$", "$options": "i"},
-            "amount": amount_str,
-        })
+        student = await db.pianostudents.find_one(
+            {
+                "ParentName": parent_name,
+                "email": reply_to_email,
+                "amount": amount_str,
+            },
+            projection=STUDENT_PROJECTION,
+            collation=CASE_INSENSITIVE,
+        )
 
         if not student:
-            return json.dumps({
+            return _dumps({
                 "status": "not_found",
                 "message": (
                     f"No active student found for parent='{parent_name}', "
@@ -241,14 +522,14 @@ def find_student_by_parent(parent_name: str, reply_to_email: str, amount: float)
 
         # Convert ObjectId to string for JSON serialisation
         student["_id"] = str(student["_id"])
-        return json.dumps({"status": "ok", "student": student})
+        return _dumps({"status": "ok", "student": student})
 
     except Exception as e:
-        return json.dumps({"status": "error", "message": str(e)})
+        return _dumps({"status": "error", "message": str(e)})
 
 
 @mcp.tool()
-def check_invoice_exists(student_email: str) -> str:
+async def check_invoice_exists(student_email: str) -> str:
     """
     Check whether an invoice already exists in the invoices collection
     for the given student email in the CURRENT calendar month.
@@ -258,37 +539,33 @@ def check_invoice_exists(student_email: str) -> str:
     try:
         db = _get_mongo_db()
 
-        now = datetime.now(timezone.utc)
         # Start and end of current month
-        start_of_month = datetime(now.year, now.month, 1, tzinfo=timezone.utc)
-        if now.month == 12:
-            end_of_month = datetime(now.year + 1, 1, 1, tzinfo=timezone.utc)
-        else:
-            end_of_month = datetime(now.year, now.month + 1, 1, tzinfo=timezone.utc)
-
-        invoice = db.invoices.find_one({
-            "students.email": {"$regex": f"^{re.escape(student_email)}$", "$options": "i"},
-            "feepaiddate": {
-                "$gte": start_of_month,
-                "$lt": end_of_month,
+        start_of_month, end_of_month, _ = _current_month_window()
+
+        invoice = await db.invoices.find_one(
+            {
+                "students.email": student_email,
+                "feepaiddate": {
+                    "$gte": start_of_month,
+                    "$lt": end_of_month,
+                },
             },
-        })
+            projection=INVOICE_PROJECTION,
+            collation=CASE_INSENSITIVE,
+        )
 
         if invoice:
             invoice["_id"] = str(invoice["_id"])
-            # Convert datetime fields to ISO strings for JSON
-            if isinstance(invoice.get("feepaiddate"), datetime):
-                invoice["feepaiddate"] = invoice["feepaiddate"].isoformat()
-            return json.dumps({"exists": True, "invoice": invoice})
+            return _dumps({"exists": True, "invoice": invoice})
 
-        return json.dumps({"exists": False, "invoice": None})
+        return _dumps({"exists": False, "invoice": None})
 
     except Exception as e:
-        return json.dumps({"status": "error", "message": str(e)})
+        return _dumps({"status": "error", "message": str(e)})
 
 
 @mcp.tool()
-def create_invoice(
+async def create_invoice(
     student_name: str,
     student_email: str,
     amount: float,
@@ -309,39 +586,95 @@ def create_invoice(
     try:
         db = _get_mongo_db()
 
-        invoice_number = str(int(time.time() * 1000))  # millisecond timestamp
+        invoice_number = _next_invoice_number()  # millisecond timestamp
         fee_paid_date = datetime.fromisoformat(fee_paid_date_iso).astimezone(timezone.utc)
+        doc = _build_invoice_doc(invoice_number, student_name, student_email, amount, fee_paid_date)
 
-        doc = {
-            "invoicenumber": invoice_number,
-            "students": {
-                "name": student_name,
-                "address": "",
-                "email": student_email,
-                "phone": "",
-            },
-            "totalamount": float(amount),
-            "tax": 0,
-            "feepaiddate": fee_paid_date,
-            "paymentstatus": "Paid",
-            "items": [],
-            "dateissued": int(time.time() * 1000),
-            "__v": 0,
-        }
-
-        result = db.invoices.insert_one(doc)
-        return json.dumps({
+        result = await db.invoices.insert_one(doc)
+        return _dumps({
             "status": "ok",
             "invoice_number": invoice_number,
             "inserted_id": str(result.inserted_id),
         })
 
     except Exception as e:
-        return json.dumps({"status": "error", "message": str(e)})
+        return _dumps({"status": "error", "message": str(e)})
 
 
 @mcp.tool()
-def send_thank_you_email(
+async def create_invoice_if_absent(
+    student_name: str,
+    student_email: str,
+    amount: float,
+    fee_paid_date_iso: str,
+) -> str:
+    """
+    Create an invoice for the student unless one already exists for the
+    calendar month of fee_paid_date_iso. The check and the insert are a
+    single upsert; a concurrent duplicate is rejected by the unique
+    (students.email, invoicemonth) index and reported as skipped.
+
+    Args:
+        student_name:       e.g. "Yanish"
+        student_email:      e.g. "test@gmail.com"
+        amount:             e.g. 200.0
+        fee_paid_date_iso:  ISO 8601 string of when payment was received,
+                            e.g. "2026-02-15T14:30:00+00:00"
+
+    Returns JSON: { "status": "created", "invoice_number": ... }
+               or { "status": "skipped", "message": ... }
+    """
+    try:
+        db = _get_mongo_db()
+
+        invoice_number = _next_invoice_number()  # millisecond timestamp
+        fee_paid_date = datetime.fromisoformat(fee_paid_date_iso).astimezone(timezone.utc)
+        start_of_month, end_of_month, _ = _month_window(fee_paid_date.year, fee_paid_date.month)
+        doc = _build_invoice_doc(invoice_number, student_name, student_email, amount, fee_paid_date)
+
+        # On insert, Mongo copies students.email from the filter, so the
+        # students sub-document is set field by field to avoid a path conflict.
+        students = doc.pop("students")
+        del students["email"]
+        doc.update({f"students.{k}": v for k, v in students.items()})
+
+        skipped = _dumps({
+            "status": "skipped",
+            "message": f"Invoice already exists for {student_email} in {doc['invoicemonth']}",
+        })
+        # The feepaiddate range (not invoicemonth) is what's matched, so
+        # invoices written before invoicemonth existed are still found.
+        try:
+            result = await db.invoices.update_one(
+                {
+                    "students.email": student_email,
+                    "feepaiddate": {
+                        "$gte": start_of_month,
+                        "$lt": end_of_month,
+                    },
+                },
+                {"$setOnInsert": doc},
+                upsert=True,
+                collation=CASE_INSENSITIVE,
+            )
+        except DuplicateKeyError:
+            return skipped
+
+        if result.upserted_id is None:
+            return skipped
+
+        return _dumps({
+            "status": "created",
+            "invoice_number": invoice_number,
+            "inserted_id": str(result.upserted_id),
+        })
+
+    except Exception as e:
+        return _dumps({"status": "error", "message": str(e)})
+
+
+@mcp.tool()
+async def send_thank_you_email(
     student_name: str,
     student_email: str,
     amount: float,
@@ -363,7 +696,9 @@ def send_thank_you_email(
         month_year = fee_paid_date.strftime("%b %Y")   # e.g. "Feb 2026"
 
         # ── Generate PDF receipt ──────────────────────────────────
-        pdf_bytes = generate_receipt(
+        # ReportLab is CPU-bound; keep it off the event loop
+        pdf_bytes = await asyncio.to_thread(
+            generate_receipt,
             receipt_number=invoice_number,
             paid_on=fee_paid_date,
             student_name=student_name,
@@ -372,38 +707,119 @@ def send_thank_you_email(
         )
 
         # ── Build email ───────────────────────────────────────────
-        msg = MIMEMultipart()
+        msg = EmailMessage()
         msg["From"] = SMTP_USER
         msg["To"] = student_email
         msg["Subject"] = f"Receipt for lesson payment {month_year} | SJ Piano Academy"
-        msg["Bcc"] = BCC_EMAIL
+        if BCC_EMAIL:
+            msg["Bcc"] = BCC_EMAIL
         body = (
             "We have attached a digital copy of your receipt for your convenience."
         )
-        msg.attach(MIMEText(body, "plain"))
+        msg.set_content(body)
 
         # Attach PDF
-        attachment = MIMEApplication(pdf_bytes, _subtype="pdf")
-        attachment.add_header(
-            "Content-Disposition",
-            "attachment",
+        msg.add_attachment(
+            pdf_bytes,
+            maintype="application",
+            subtype="pdf",
             filename=f"Receipt_{invoice_number}.pdf",
         )
-        msg.attach(attachment)
 
         # ── Send via Gmail SMTP ───────────────────────────────────
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as smtp:
-            smtp.login(SMTP_USER, SMTP_APP_PASSWORD)
-            smtp.sendmail(SMTP_USER, [student_email, BCC_EMAIL], msg.as_string())
+        # send_message delivers to To + Bcc and strips the Bcc header
+        await asyncio.to_thread(_smtp_send_message, msg)
 
-        return json.dumps({
+        return _dumps({
             "status": "ok",
             "message": f"Thank you email sent to {student_email}",
             "receipt_number": invoice_number,
         })
 
     except Exception as e:
-        return json.dumps({"status": "error", "message": str(e)})
+        return _dumps({"status": "error", "message": str(e)})
+
+
+async def _process_one(email: dict, student_locks: dict) -> dict:
+    """Validate, invoice and acknowledge a single Interac email."""
+    summary = {
+        "message_id": email.get("message_id"),
+        "parent_name": email.get("parent_name"),
+        "amount": email.get("amount"),
+    }
+    if not email.get("parent_name") or email.get("amount") is None:
+        return {**summary, "action": "error", "message": "Could not parse subject"}
+
+    found = orjson.loads(await find_student_by_parent(
+        email["parent_name"],
+        email.get("reply_to") or "",
+        email["amount"],
+    ))
+    if found.get("status") != "ok":
+        return {**summary, "action": "skipped", "message": found.get("message")}
+
+    student = found["student"]
+    student_email = student.get("email", "")
+    student_name = student.get("name") or student.get("StudentName") or ""
+    summary.update(student_name=student_name, student_email=student_email)
+
+    # Serialize invoice → send per student so two payments from the same
+    # family in one run can never produce duplicate invoices.
+    lock = student_locks.setdefault(student_email.lower(), asyncio.Lock())
+    async with lock:
+        created = orjson.loads(await create_invoice_if_absent(
+            student_name,
+            student_email,
+            email["amount"],
+            email["date_received"],
+        ))
+        if created.get("status") == "skipped":
+            return {**summary, "action": "skipped", "message": created.get("message")}
+        if created.get("status") != "created":
+            return {**summary, "action": "error", "message": created.get("message")}
+
+        sent = orjson.loads(await send_thank_you_email(
+            student_name,
+            student_email,
+            email["amount"],
+            created["invoice_number"],
+            email["date_received"],
+        ))
+
+    summary["invoice_number"] = created["invoice_number"]
+    if sent.get("status") != "ok":
+        return {**summary, "action": "error", "message": sent.get("message")}
+    return {**summary, "action": "processed"}
+
+
+@mcp.tool()
+async def process_all_payments() -> str:
+    """
+    Run the full workflow for every Interac email this month in one call:
+    validate student → create invoice if absent → send receipt.
+
+    Emails are processed concurrently; the steps for a single student stay
+    sequential.
+
+    Returns JSON: { "status": "ok", "results": [ {..., "action": ...}, ... ] }
+    where action is one of "processed", "skipped" or "error".
+    """
+    try:
+        found = orjson.loads(await asyncio.to_thread(search_interac_emails))
+        if found.get("status") != "ok":
+            return _dumps(found)
+
+        student_locks = {}
+        async with asyncio.TaskGroup() as tg:
+            tasks = [
+                tg.create_task(_process_one(e, student_locks))
+                for e in found["emails"]
+            ]
+
+        return _dumps({"status": "ok", "results": [t.result() for t in tasks]})
+
+    except Exception as e:
+        return _dumps({"status": "error", "message": str(e)})
 
 
 # ════════════════════════════════════════════════════════════════════════════
@@ -412,4 +828,5 @@ def send_thank_you_email(
 
 if __name__ == "__main__":
     print("🎹 SJ Piano MCP Server starting...")
+    ensure_indexes()
     mcp.run(transport="stdio")
@@ -1,19 +1,73 @@
 """
 receipt_generator.py
 Generates a PDF receipt that matches the SJ Piano Academy receipt style.
+
+The receipt is a fixed one-page layout, so it is drawn directly on a
+canvas at known coordinates rather than laid out with Platypus flowables.
 """
 
 import os
 import io
+import functools
 from datetime import datetime
 from reportlab.lib.pagesizes import letter
 from reportlab.lib import colors
 from reportlab.lib.units import inch
-from reportlab.platypus import (
-    SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, HRFlowable
-)
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.enums import TA_RIGHT, TA_LEFT, TA_CENTER
+from reportlab.pdfgen import canvas
+
+
+# ── Layout (points, origin bottom-left of a letter page) ──────────
+LEFT = 0.75 * inch + 6           # left edge of the content block
+RIGHT = letter[0] - LEFT         # right edge of the content block
+TEXT_LEFT = LEFT + 6             # cell padding
+TEXT_RIGHT = RIGHT - 6
+ROW_HEIGHT = 28
+LINE_HEIGHT = 16
+
+FONT = "Helvetica"
+FONT_BOLD = "Helvetica-Bold"
+FONT_SIZE = 10
+
+HEADER_BG = colors.Color(0.93, 0.93, 0.93)
+RULE_COLOR = colors.grey
+
+# Logo box (top-left) and receipt info (top-right)
+LOGO_X, LOGO_Y, LOGO_W, LOGO_H = LEFT, 684, 1.2 * inch, 48
+TOP_INFO_Y = 718
+
+# Academy address (left) and student info (right)
+INFO_Y = 642.2
+
+# Payment method and items tables: y of the bottom of each header bar
+PAYMENT_HEADER_Y = 544.4
+ITEMS_HEADER_Y = 474
+
+
+@functools.lru_cache(maxsize=1)
+def _academy_details() -> tuple:
+    """Return (name, address, city) for the receipt header."""
+    return (
+        os.getenv("ACADEMY_NAME", "SJ Piano Academy."),
+        os.getenv("ACADEMY_ADDRESS", "2869 Battleford Rd"),
+        os.getenv("ACADEMY_CITY", "Mississauga,ON L5N 2S6"),
+    )
+
+
+def _draw_header_bar(c: canvas.Canvas, y: float, left_label: str, right_label: str):
+    """Draw a grey header row with a rule under it, bottom edge at y."""
+    c.setFillColor(HEADER_BG)
+    c.rect(LEFT, y, RIGHT - LEFT, ROW_HEIGHT, stroke=0, fill=1)
+    c.setFillColor(colors.black)
+    c.setFont(FONT_BOLD, FONT_SIZE)
+    c.drawString(TEXT_LEFT, y + 12, left_label)
+    c.drawRightString(TEXT_RIGHT, y + 12, right_label)
+    _draw_rule(c, y)
+
+
+def _draw_rule(c: canvas.Canvas, y: float):
+    c.setStrokeColor(RULE_COLOR)
+    c.setLineWidth(0.5)
+    c.line(LEFT, y, RIGHT, y)
 
 
 def generate_receipt(
@@ -40,174 +94,47 @@ def generate_receipt(
     """
 
     buffer = io.BytesIO()
-    doc = SimpleDocTemplate(
-        buffer,
-        pagesize=letter,
-        rightMargin=0.75 * inch,
-        leftMargin=0.75 * inch,
-        topMargin=0.75 * inch,
-        bottomMargin=0.75 * inch,
-    )
-
-    styles = getSampleStyleSheet()
+    c = canvas.Canvas(buffer, pagesize=letter)
 
-    # ── Custom styles ──────────────────────────────────────────────
-    header_right = ParagraphStyle(
-        "header_right",
-        parent=styles["Normal"],
-        alignment=TA_RIGHT,
-        fontSize=10,
-        leading=16,
-    )
-    normal_left = ParagraphStyle(
-        "normal_left",
-        parent=styles["Normal"],
-        alignment=TA_LEFT,
-        fontSize=10,
-        leading=16,
-    )
-    bold_left = ParagraphStyle(
-        "bold_left",
-        parent=styles["Normal"],
-        alignment=TA_LEFT,
-        fontSize=10,
-        leading=16,
-        fontName="Helvetica-Bold",
-    )
-    bold_right = ParagraphStyle(
-        "bold_right",
-        parent=styles["Normal"],
-        alignment=TA_RIGHT,
-        fontSize=10,
-        leading=16,
-        fontName="Helvetica-Bold",
-    )
-
-    academy_name = os.getenv("ACADEMY_NAME", "SJ Piano Academy.")
-    academy_addr = os.getenv("ACADEMY_ADDRESS", "2869 Battleford Rd")
-    academy_city = os.getenv("ACADEMY_CITY", "Mississauga,ON L5N 2S6")
+    academy_name, academy_addr, academy_city = _academy_details()
     paid_on_str = paid_on.strftime("%b %d, %Y")
 
-    story = []
-
     # ── Top: Logo placeholder (SJ PA box) + Receipt info ──────────
-    logo_text = Paragraph(
-        "<b>SJ<br/>PA</b>",
-        ParagraphStyle(
-            "logo",
-            parent=styles["Normal"],
-            fontSize=16,
-            leading=20,
-            fontName="Helvetica-Bold",
-            alignment=TA_CENTER,
-            borderPadding=6,
-        ),
-    )
-
-    receipt_info = Paragraph(
-        f"Receipt #: {receipt_number}<br/>Paid on : {paid_on_str}",
-        header_right,
-    )
-
-    top_table = Table(
-        [[logo_text, receipt_info]],
-        colWidths=[1.2 * inch, None],
-    )
-    top_table.setStyle(
-        TableStyle([
-            ("VALIGN", (0, 0), (-1, -1), "TOP"),
-            ("ALIGN", (1, 0), (1, 0), "RIGHT"),
-            ("BOX", (0, 0), (0, 0), 1, colors.black),
-            ("TOPPADDING", (0, 0), (-1, -1), 4),
-            ("BOTTOMPADDING", (0, 0), (-1, -1), 4),
-        ])
-    )
-    story.append(top_table)
-    story.append(Spacer(1, 0.4 * inch))
+    c.setStrokeColor(colors.black)
+    c.setLineWidth(1)
+    c.rect(LOGO_X, LOGO_Y, LOGO_W, LOGO_H, stroke=1, fill=0)
+    c.setFont(FONT_BOLD, 16)
+    logo_center = LOGO_X + LOGO_W / 2
+    c.drawCentredString(logo_center, LOGO_Y + 28, "SJ")
+    c.drawCentredString(logo_center, LOGO_Y + 8, "PA")
+
+    c.setFont(FONT, FONT_SIZE)
+    c.drawRightString(TEXT_RIGHT, TOP_INFO_Y, f"Receipt #: {receipt_number}")
+    c.drawRightString(TEXT_RIGHT, TOP_INFO_Y - LINE_HEIGHT, f"Paid on : {paid_on_str}")
 
     # ── Middle: Academy address (left) + Student info (right) ─────
-    addr_block = Paragraph(
-        f"{academy_name}<br/>{academy_addr}<br/>{academy_city}",
-        normal_left,
-    )
-    student_block = Paragraph(
-        f"{student_name}<br/>{student_email}",
-        ParagraphStyle(
-            "student",
-            parent=styles["Normal"],
-            alignment=TA_RIGHT,
-            fontSize=10,
-            leading=16,
-        ),
-    )
-
-    info_table = Table(
-        [[addr_block, student_block]],
-        colWidths=[3.5 * inch, None],
-    )
-    info_table.setStyle(
-        TableStyle([
-            ("VALIGN", (0, 0), (-1, -1), "TOP"),
-        ])
-    )
-    story.append(info_table)
-    story.append(Spacer(1, 0.4 * inch))
+    for i, line in enumerate((academy_name, academy_addr, academy_city)):
+        c.drawString(TEXT_LEFT, INFO_Y - i * LINE_HEIGHT, line)
+    c.drawRightString(TEXT_RIGHT, INFO_Y, student_name)
+    c.drawRightString(TEXT_RIGHT, INFO_Y - LINE_HEIGHT, student_email)
 
     # ── Payment Method table ───────────────────────────────────────
-    payment_data = [
-        [
-            Paragraph("Payment Method", bold_left),
-            Paragraph("Check #", bold_right),
-        ],
-        [
-            Paragraph("E Transfer", normal_left),
-            Paragraph("NA", ParagraphStyle("na", parent=styles["Normal"], alignment=TA_RIGHT, fontSize=10)),
-        ],
-    ]
-    payment_table = Table(payment_data, colWidths=[3.5 * inch, None])
-    payment_table.setStyle(
-        TableStyle([
-            ("BACKGROUND", (0, 0), (-1, 0), colors.Color(0.93, 0.93, 0.93)),
-            ("LINEBELOW", (0, 0), (-1, 0), 0.5, colors.grey),
-            ("TOPPADDING", (0, 0), (-1, -1), 6),
-            ("BOTTOMPADDING", (0, 0), (-1, -1), 6),
-            ("LEFTPADDING", (0, 0), (-1, -1), 6),
-            ("RIGHTPADDING", (0, 0), (-1, -1), 6),
-        ])
-    )
-    story.append(payment_table)
-    story.append(Spacer(1, 0.2 * inch))
+    _draw_header_bar(c, PAYMENT_HEADER_Y, "Payment Method", "Check #")
+    c.setFont(FONT, FONT_SIZE)
+    c.drawString(TEXT_LEFT, PAYMENT_HEADER_Y - 16, "E Transfer")
+    c.drawRightString(TEXT_RIGHT, PAYMENT_HEADER_Y - 20, "NA")
 
     # ── Items table ────────────────────────────────────────────────
-    items_data = [
-        [
-            Paragraph("Item", bold_left),
-            Paragraph("Price", bold_right),
-        ],
-        [
-            Paragraph("Piano Class", normal_left),
-            Paragraph(f"${amount:,.0f}", ParagraphStyle("price", parent=styles["Normal"], alignment=TA_RIGHT, fontSize=10)),
-        ],
-        [
-            Paragraph("", normal_left),
-            Paragraph(f"<b>Total: ${amount:,.0f}</b>", bold_right),
-        ],
-    ]
-    items_table = Table(items_data, colWidths=[3.5 * inch, None])
-    items_table.setStyle(
-        TableStyle([
-            ("BACKGROUND", (0, 0), (-1, 0), colors.Color(0.93, 0.93, 0.93)),
-            ("LINEBELOW", (0, 0), (-1, 0), 0.5, colors.grey),
-            ("LINEABOVE", (0, 2), (-1, 2), 0.5, colors.grey),
-            ("TOPPADDING", (0, 0), (-1, -1), 6),
-            ("BOTTOMPADDING", (0, 0), (-1, -1), 6),
-            ("LEFTPADDING", (0, 0), (-1, -1), 6),
-            ("RIGHTPADDING", (0, 0), (-1, -1), 6),
-        ])
-    )
-    story.append(items_table)
-
-    doc.build(story)
+    _draw_header_bar(c, ITEMS_HEADER_Y, "Item", "Price")
+    c.setFont(FONT, FONT_SIZE)
+    c.drawString(TEXT_LEFT, ITEMS_HEADER_Y - 16, "Piano Class")
+    c.drawRightString(TEXT_RIGHT, ITEMS_HEADER_Y - 20, f"${amount:,.0f}")
+    _draw_rule(c, ITEMS_HEADER_Y - ROW_HEIGHT)
+    c.setFont(FONT_BOLD, FONT_SIZE)
+    c.drawRightString(TEXT_RIGHT, ITEMS_HEADER_Y - 44, f"Total: ${amount:,.0f}")
+
+    c.showPage()
+    c.save()
     pdf_bytes = buffer.getvalue()
     buffer.close()
 